@@ -0,0 +1,25 @@
+-- Mevcut bir buharindan veritabanını ilan soft-delete şemasına taşır.
+-- SQL Query.sql sıfırdan kurulum içindir (DROP DATABASE); bu dosya veriyi
+-- korur. Sadece bir kez çalıştırılmalıdır.
+-- listing_deletedat uygulama tarafından UTC olarak yazılır (UTC_TIMESTAMP()).
+
+USE buharindan;
+
+ALTER TABLE listings_table
+    ADD COLUMN listing_deletedat DATETIME NULL DEFAULT NULL AFTER listing_imagepath,
+    ADD INDEX listing_deletedat (listing_deletedat);
+
+CREATE OR REPLACE VIEW user_listing_genre_view AS
+SELECT 
+    l.listing_id,
+    l.listing_name,
+    l.listing_price,
+    l.listing_condition,
+    u.user_name AS seller_name,
+    u.user_city,
+    g.genre_name
+FROM listings_table l
+JOIN users_table u ON l.listing_ownerid = u.user_id
+JOIN listing_genres lg ON l.listing_id = lg.listing_id
+JOIN genres g ON lg.genre_id = g.genre_id
+WHERE l.listing_deletedat IS NULL;
@@ -21,6 +21,8 @@ CREATE TABLE listings_table (
     listing_date DATE NOT NULL,
     listing_desc VARCHAR(200),
     listing_imagepath text,
+    listing_deletedat DATETIME NULL DEFAULT NULL,
+    INDEX listing_deletedat (listing_deletedat),
     FOREIGN KEY (listing_ownerid) REFERENCES users_table(user_id)
 );
 
@@ -173,4 +175,5 @@ SELECT
 FROM listings_table l
 JOIN users_table u ON l.listing_ownerid = u.user_id
 JOIN listing_genres lg ON l.listing_id = lg.listing_id
-JOIN genres g ON lg.genre_id = g.genre_id;
\ No newline at end of file
+JOIN genres g ON lg.genre_id = g.genre_id
+WHERE l.listing_deletedat IS NULL;
\ No newline at end of file
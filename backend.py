@@ -2,18 +2,36 @@ from fastapi import FastAPI, HTTPException, Depends, Response, Cookie
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 from fastapi import UploadFile, File
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 import os
-import shutil
 import os
 import secrets
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.datastructures import Headers, MutableHeaders
+from decimal import Decimal
+import brotli
+import gzip
+import numpy as np
+import orjson
+import anyio
+import math
+import re
+import tempfile
+import threading
+import time
 
 
 
@@ -21,6 +39,10 @@ from fastapi.staticfiles import StaticFiles
 load_dotenv()
 
 IMAGES_DIR = "images"
+# Yüklenen dosyalar önce burada yazılır: /images altında servis edilmez ama
+# images ile aynı dosya sisteminde olmalı ki os.replace atomik olsun
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", ".upload_tmp")
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
 
 DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
@@ -30,8 +52,372 @@ DB_PORT = os.getenv("DB_PORT")
 
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL, echo=True)
-app = FastAPI()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+# Startup'ta açılacak bağlantı. pool_size'ı aşanlar overflow'dur, close()'da atılır;
+# pool_size + max_overflow'u aşan connect() ise pool timeout kadar bloklanır.
+DB_POOL_WARMUP = min(int(os.getenv("DB_POOL_WARMUP", str(DB_POOL_SIZE))), DB_POOL_SIZE)
+
+engine = create_engine(DATABASE_URL, echo=True, pool_size=DB_POOL_SIZE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Deploy sonrası ilk istekler bağlantı kurma ve sorgu derleme maliyetini ödemesin
+    await run_in_threadpool(sweep_stale_uploads)
+    await run_in_threadpool(warm_up_pool)
+    await run_in_threadpool(rebuild_similar_index)
+    purge_worker.start()
+    yield
+    # stop() thread'i join ile bekler, event loop'u bloklamasın
+    await run_in_threadpool(purge_worker.stop)
+
+
+app = FastAPI(lifespan=lifespan)
+
+# -----------------------------
+# RATE LIMITING / ADMISSION CONTROL
+# -----------------------------
+# Her istemci (token'daki user_id, yoksa IP) için tek bir token bucket tutulur.
+# Her istek, ait olduğu endpoint sınıfının "cost" değeri kadar token harcar.
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "10"))     # saniyede eklenen token
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "40"))   # bucket kapasitesi
+
+# Endpoint sınıfları: token maliyeti ve aynı anda çalışabilecek istek sayısı
+ROUTE_CLASSES = {
+    "auth":    {"cost": 5, "max_concurrency": int(os.getenv("RATE_LIMIT_AUTH_CONCURRENCY", "4"))},
+    "upload":  {"cost": 5, "max_concurrency": int(os.getenv("RATE_LIMIT_UPLOAD_CONCURRENCY", "4"))},
+    "catalog": {"cost": 2, "max_concurrency": int(os.getenv("RATE_LIMIT_CATALOG_CONCURRENCY", "16"))},
+    "default": {"cost": 1, "max_concurrency": int(os.getenv("RATE_LIMIT_DEFAULT_CONCURRENCY", "32"))},
+}
+
+# Yanlış ayar sessizce her isteği reddetmesin (rate=0 sıfıra bölme, cost > burst sonsuz 429)
+if RATE_LIMIT_RATE <= 0 or RATE_LIMIT_BURST <= 0:
+    raise ValueError("RATE_LIMIT_RATE and RATE_LIMIT_BURST must be positive")
+
+for _name, _limits in ROUTE_CLASSES.items():
+    if _limits["cost"] > RATE_LIMIT_BURST:
+        raise ValueError(f"Route class '{_name}' costs {_limits['cost']} tokens, more than RATE_LIMIT_BURST ({RATE_LIMIT_BURST:g})")
+    if _limits["max_concurrency"] <= 0:
+        raise ValueError(f"Route class '{_name}' needs a positive max_concurrency")
+
+ROUTE_PATTERNS = [
+    ("POST", re.compile(r"^/(login|register)$"), "auth"),
+    ("POST", re.compile(r"^/listings/\d+/upload_image$"), "upload"),
+    ("GET", re.compile(r"^/(listings|search|filters/listings|view/user_listing_genre)$"), "catalog"),
+]
+
+
+def classify_route(method: str, path: str) -> str:
+    for route_method, pattern, route_class in ROUTE_PATTERNS:
+        if method == route_method and pattern.match(path):
+            return route_class
+    return "default"
+
+
+class RateLimitBackend(ABC):
+    """Token bucket durumunu saklayan arayüz.
+
+    Varsayılan olarak süreç içi (in-process) saklanır. Birden fazla worker
+    aynı limiti paylaşacaksa (ör. Redis) bu sınıftan türetilip take()
+    yazılması ve RateLimitMiddleware'e backend olarak verilmesi yeterlidir.
+    take() event loop üzerinde çağrılır, bu yüzden async'tir; ağ üzerinden
+    çalışan bir backend bloklayan çağrı yapmamalıdır.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> tuple[bool, float]:
+        """cost kadar token düşmeyi dener. (izin verildi mi, kaç saniye sonra tekrar denenmeli)"""
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        # key -> (tokens, son güncelleme zamanı); en eski kullanılan başta (LRU)
+        self.buckets = OrderedDict()
+
+    async def take(self, key, cost, rate, burst):
+        # Event loop tek thread olduğu için kilit gerekmez
+        now = time.monotonic()
+
+        tokens, last = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+
+        if tokens >= cost:
+            self.buckets[key] = (tokens - cost, now)
+            allowed, retry_after = True, 0.0
+        else:
+            self.buckets[key] = (tokens, now)
+            allowed, retry_after = False, (cost - tokens) / rate
+
+        # Boyut sınırı aşılırsa en uzun süredir görülmeyen bucket'ları at (O(1))
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+
+        return allowed, retry_after
+
+
+def rate_limit_key(scope) -> str:
+    token = Request(scope).cookies.get("access_token")
+
+    if token:
+        try:
+            user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            if user_id:
+                return f"user:{user_id}"
+        except JWTError:
+            pass
+
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+class RateLimitMiddleware:
+    """Token bucket (429) ve endpoint sınıfı başına eşzamanlılık sınırı (503) uygular.
+
+    Token bucket'lar backend'de tutulur ve worker'lar arasında paylaşılabilir.
+    Eşzamanlılık sayaçları (inflight) ise bu sürece aittir: birden fazla
+    worker çalışıyorsa max_concurrency her worker için ayrı ayrı geçerlidir.
+    """
+
+    def __init__(self, app, backend: Optional[RateLimitBackend] = None):
+        self.app = app
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.inflight = {name: 0 for name in ROUTE_CLASSES}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify_route(scope["method"], scope["path"])
+        limits = ROUTE_CLASSES[route_class]
+
+        # Önce eşzamanlılık kontrolü: 503 ile reddedilen istek token harcamasın
+        if self.inflight[route_class] >= limits["max_concurrency"]:
+            response = JSONResponse(
+                {"detail": "Server busy, try again later"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        # take() await edildiği için slot önceden ayrılır, aradaki istekler sınırı aşmasın
+        self.inflight[route_class] += 1
+        try:
+            allowed, retry_after = await self.backend.take(
+                rate_limit_key(scope), limits["cost"], RATE_LIMIT_RATE, RATE_LIMIT_BURST
+            )
+
+            if not allowed:
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+                await response(scope, receive, send)
+                return
+
+            await self.app(scope, receive, send)
+        finally:
+            self.inflight[route_class] -= 1
+
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(5 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_FORM_OVERHEAD = 16 * 1024   # multipart boundary ve header'ları için pay
+UPLOAD_TMP_MAX_AGE = int(os.getenv("UPLOAD_TMP_MAX_AGE", "3600"))   # saniye
+
+
+def sweep_stale_uploads():
+    """Çöken/yarıda kalan upload'lardan kalan .part dosyalarını siler.
+
+    Birden fazla worker aynı klasörü paylaşabileceği için yalnızca
+    UPLOAD_TMP_MAX_AGE'den eski dosyalar silinir.
+    """
+    cutoff = time.time() - UPLOAD_TMP_MAX_AGE
+
+    for entry in os.scandir(UPLOAD_TMP_DIR):
+        if not entry.name.endswith(".part") or not entry.is_file():
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class UploadSizeLimitMiddleware:
+    """Upload isteklerinin gövdesini okunurken sayar, sınırı aşanı 413 ile keser."""
+
+    def __init__(self, app, max_body: int):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or classify_route(scope["method"], scope["path"]) != "upload":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and (not content_length.isdigit() or int(content_length) > self.max_body):
+            response = JSONResponse({"detail": "File too large"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # FastAPI body parse sırasında gelen HTTPException'ı olduğu gibi geçirir
+                    raise HTTPException(status_code=413, detail="File too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# -----------------------------
+# RESPONSE SERIALIZATION / COMPRESSION
+# -----------------------------
+# Liste endpoint'leri satırları jsonable_encoder + json yerine doğrudan orjson ile yazar.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4
+# Bu boyutun üzerindeki gövdeler thread'de sıkıştırılır, event loop'u bloklamasın.
+# Küçük gövdelerde thread'e geçiş maliyeti sıkıştırmanın kendisinden fazla.
+COMPRESS_OFFLOAD_BYTES = int(os.getenv("COMPRESS_OFFLOAD_BYTES", str(64 * 1024)))
+
+
+def orjson_default(value):
+    # orjson date/datetime'ı kendisi yazar, Decimal'i jsonable_encoder ile aynı şekilde çevir
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """Handler'dan doğrudan dönülür, böylece FastAPI jsonable_encoder'ı çalıştırmaz."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=orjson_default)
+
+
+def rows_to_dicts(result) -> list[dict]:
+    # row._mapping yerine kolon isimlerini bir kere alıp zip'le
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+
+        try:
+            q = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            q = 0.0
+
+        if q > 0:
+            accepted.add(name.strip())
+
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """COMPRESS_MIN_BYTES üzerindeki JSON cevaplarını istemcinin kabul ettiği formatta sıkıştırır."""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def compressing_send(message):
+            nonlocal start_message
+
+            # Başlıkları body görülene kadar beklet, Content-Length değişebilir
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            # Body dışı mesajlar (ör. FileResponse'un http.response.pathsend'i) sıkıştırılmaz;
+            # bekletilen başlık önce gönderilmeli, yoksa cevap hiç başlamaz
+            if message["type"] != "http.response.body":
+                if start_message is not None:
+                    start, start_message = start_message, None
+                    await send(start)
+                await send(message)
+                return
+
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith("application/json")
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= COMPRESS_OFFLOAD_BYTES:
+                body = await anyio.to_thread.run_sync(compress_body, body, encoding)
+            else:
+                body = compress_body(body, encoding)
+
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compressing_send)
+
+
+# -----------------------------
+# MIDDLEWARE
+# -----------------------------
+rate_limit_backend = InMemoryRateLimitBackend()
+
+# Sıra önemli: en son eklenen en dışta çalışır (CORS > rate limit > upload boyutu > sıkıştırma).
+# CORS en dışta olmalı ki 413/429/503 cevapları da CORS header'ı alsın.
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(UploadSizeLimitMiddleware, max_body=UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD)
+app.add_middleware(RateLimitMiddleware, backend=rate_limit_backend)
 
 # CORS AYARI
 app.add_middleware(
@@ -112,6 +498,285 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# -----------------------------
+# SQL STATEMENTS
+# -----------------------------
+# Tüm sorgular modül yüklenirken bir kere oluşturulur; handler'lar her istekte
+# yeni text() üretmez, SQLAlchemy'nin compiled cache'i aynı nesneyi tekrar kullanır.
+STATEMENTS = {
+    # users
+    "user_id_by_id": text("SELECT user_id FROM users_table WHERE user_id = :uid"),
+    "user_id_by_phone": text("SELECT user_id FROM users_table WHERE user_phonenumber = :phone"),
+    "user_insert": text("""
+        INSERT INTO users_table 
+        (user_id, user_name, user_city, user_restofaddress, 
+         user_phonenumber, user_passwordhashes)
+        VALUES (:uid, :name, :city, :addr, :phone, :pwd)
+    """),
+    "user_password_hash": text("SELECT user_passwordhashes FROM users_table WHERE user_id = :uid"),
+    "user_info": text("""
+        SELECT user_id, user_name, user_city, user_restofaddress, user_phonenumber 
+        FROM users_table 
+        WHERE user_id = :uid
+    """),
+    "users_all": text("SELECT * FROM users_table"),
+    "user_by_id": text("SELECT * FROM users_table WHERE user_id = :uid"),
+    "user_update": text("""
+        UPDATE users_table
+        SET user_name = :user_name,
+            user_city = :user_city,
+            user_restofaddress = :user_restofaddress,
+            user_phonenumber = :user_phonenumber
+        WHERE user_id = :user_id
+    """),
+    "user_update_with_password": text("""
+        UPDATE users_table
+        SET user_name = :user_name,
+            user_city = :user_city,
+            user_restofaddress = :user_restofaddress,
+            user_phonenumber = :user_phonenumber,
+            user_passwordhashes = :user_passwordhashes
+        WHERE user_id = :user_id
+    """),
+
+    # listings
+    "listings_all": text("""
+        SELECT 
+            l.*, u.*
+        FROM listings_table l
+        JOIN users_table u 
+        ON l.listing_ownerid = u.user_id
+        WHERE l.listing_deletedat IS NULL
+    """),
+    "listing_by_id": text("""
+        SELECT l.*, u.*
+        FROM listings_table as l
+        JOIN users_table as u
+        ON l.listing_ownerid = u.user_id 
+        WHERE listing_id = :id AND l.listing_deletedat IS NULL
+    """),
+    "listing_genre_names": text("""
+        SELECT g.genre_name FROM genres g
+        JOIN listing_genres lg ON g.genre_id = lg.genre_id
+        WHERE lg.listing_id = :id
+    """),
+    "listing_comments": text("""
+        SELECT c.comment_content, c.comment_date, c.comment_id, c.comment_ownerid, u.user_name
+        FROM comments_table c
+        JOIN users_table u ON c.comment_ownerid = u.user_id
+        WHERE c.comment_listingid = :id
+    """),
+    "listing_owner": text("""
+        SELECT listing_ownerid FROM listings_table
+        WHERE listing_id = :id AND listing_deletedat IS NULL
+    """),
+    "listing_insert": text("""
+        INSERT INTO listings_table (
+            listing_name, listing_price, listing_ownerid, 
+            listing_condition, listing_date, listing_desc, listing_imagepath
+        )
+        VALUES (
+            :name, :price, :owner, :cond, :date, :desc, :img
+        )
+    """),
+    "last_insert_id": text("SELECT LAST_INSERT_ID()"),
+    "listing_update": text("""
+        UPDATE listings_table
+        SET 
+            listing_name = :name,
+            listing_price = :price,
+            listing_condition = :cond,
+            listing_desc = :desc
+        WHERE listing_id = :id
+    """),
+    "listing_soft_delete": text("""
+        UPDATE listings_table
+        SET listing_deletedat = UTC_TIMESTAMP()
+        WHERE listing_id = :id AND listing_deletedat IS NULL
+    """),
+    "listing_image_for_update": text("""
+        SELECT listing_imagepath FROM listings_table
+        WHERE listing_id = :id AND listing_deletedat IS NULL
+        FOR UPDATE
+    """),
+    "listing_image_update": text("""
+        UPDATE listings_table 
+        SET listing_imagepath = :path 
+        WHERE listing_id = :id
+    """),
+    "listing_genres_insert": text("INSERT INTO listing_genres (listing_id, genre_id) VALUES (:lid, :gid)"),
+    "listing_genres_delete": text("DELETE FROM listing_genres WHERE listing_id = :id"),
+    "listings_by_ids": text("""
+        SELECT l.listing_id, l.listing_name, l.listing_price, l.listing_imagepath, u.user_city
+        FROM listings_table l
+        JOIN users_table u ON l.listing_ownerid = u.user_id
+        WHERE l.listing_id IN :ids AND l.listing_deletedat IS NULL
+    """).bindparams(bindparam("ids", expanding=True)),
+    "similarity_features_all": text("""
+        SELECT l.listing_id, l.listing_price, u.user_city, lg.genre_id
+        FROM listings_table l
+        JOIN users_table u ON l.listing_ownerid = u.user_id
+        LEFT JOIN listing_genres lg ON l.listing_id = lg.listing_id
+        WHERE l.listing_deletedat IS NULL
+    """),
+    "similarity_features_by_id": text("""
+        SELECT l.listing_id, l.listing_price, u.user_city, lg.genre_id
+        FROM listings_table l
+        JOIN users_table u ON l.listing_ownerid = u.user_id
+        LEFT JOIN listing_genres lg ON l.listing_id = lg.listing_id
+        WHERE l.listing_id = :id AND l.listing_deletedat IS NULL
+    """),
+    "listings_search": text("""
+        SELECT l.*, u.*
+        FROM listings_table l
+        JOIN users_table u ON l.listing_ownerid = u.user_id
+        WHERE l.listing_name LIKE :key AND l.listing_deletedat IS NULL
+    """),
+
+    # comments
+    "comments_by_listing": text("""
+        SELECT 
+            c.*,
+            u.user_name
+        FROM comments_table c
+        JOIN users_table u 
+        ON u.user_id = c.comment_ownerid
+        JOIN listings_table l
+        ON l.listing_id = c.comment_listingid
+        WHERE c.comment_listingid = :id AND l.listing_deletedat IS NULL
+    """),
+    "comment_insert": text("""
+        INSERT INTO comments_table (
+            comment_content, 
+            comment_date, 
+            comment_ownerid, 
+            comment_listingid
+        )
+        SELECT :content, :date, :owner, listing_id
+        FROM listings_table
+        WHERE listing_id = :listing AND listing_deletedat IS NULL
+    """),
+    "comment_owner": text("SELECT comment_ownerid FROM comments_table WHERE comment_id = :id"),
+    "comment_update": text("""
+        UPDATE comments_table
+        SET comment_content = :content
+        WHERE comment_id = :id
+    """),
+    "comment_delete": text("DELETE FROM comments_table WHERE comment_id = :id"),
+
+    # diğer
+    "view_user_listing_genre": text("SELECT * FROM user_listing_genre_view"),
+    "genres_all": text("SELECT genre_id, genre_name FROM genres"),
+
+    # silinen ilanların arka planda temizlenmesi
+    "purge_pending_listings": text("""
+        SELECT listing_id, listing_imagepath FROM listings_table
+        WHERE listing_deletedat IS NOT NULL
+        ORDER BY listing_deletedat
+        LIMIT :limit
+    """),
+    "purge_listing_genres_batch": text("DELETE FROM listing_genres WHERE listing_id = :id LIMIT :limit"),
+    "purge_comments_batch": text("DELETE FROM comments_table WHERE comment_listingid = :id LIMIT :limit"),
+    "purge_listing": text("DELETE FROM listings_table WHERE listing_id = :id AND listing_deletedat IS NOT NULL"),
+    "image_path_in_use": text("SELECT 1 FROM listings_table WHERE listing_imagepath = :path LIMIT 1"),
+    "purge_backlog": text("""
+        SELECT
+            (SELECT COUNT(*) FROM listings_table WHERE listing_deletedat IS NOT NULL) AS listings,
+            (SELECT COUNT(*) FROM comments_table c
+             JOIN listings_table l ON l.listing_id = c.comment_listingid
+             WHERE l.listing_deletedat IS NOT NULL) AS comments,
+            (SELECT COUNT(*) FROM listing_genres lg
+             JOIN listings_table l ON l.listing_id = lg.listing_id
+             WHERE l.listing_deletedat IS NOT NULL) AS listing_genres,
+            (SELECT MIN(listing_deletedat) FROM listings_table WHERE listing_deletedat IS NOT NULL) AS oldest_deleted_at
+    """),
+}
+
+# Filtre sorgusu: verilmeyen filtre NULL gönderilir, böylece tek SQL metni
+# her filtre kombinasyonunda kullanılabilir. Yalnızca sıralama değişir.
+FILTER_ORDER_BY = {
+    None: "",
+    ("name", "asc"): "ORDER BY l.listing_name ASC",
+    ("name", "desc"): "ORDER BY l.listing_name DESC",
+    ("price", "asc"): "ORDER BY l.listing_price ASC",
+    ("price", "desc"): "ORDER BY l.listing_price DESC",
+}
+
+FILTER_STATEMENTS = {
+    key: text(f"""
+        SELECT DISTINCT l.*, u.*
+        FROM listings_table l
+        JOIN users_table u ON l.listing_ownerid = u.user_id
+        LEFT JOIN listing_genres lg ON l.listing_id = lg.listing_id
+        LEFT JOIN genres g ON lg.genre_id = g.genre_id
+        WHERE l.listing_deletedat IS NULL
+          AND (:name IS NULL OR l.listing_name LIKE :name)
+          AND (:city IS NULL OR u.user_city = :city)
+          AND (:min_price IS NULL OR l.listing_price >= :min_price)
+          AND (:max_price IS NULL OR l.listing_price <= :max_price)
+          AND (:genre IS NULL OR g.genre_name = :genre)
+        {order_by}
+    """)
+    for key, order_by in FILTER_ORDER_BY.items()
+}
+
+# Startup warm-up'ta çalıştırılacak okuma sorguları ve zararsız parametreleri.
+# Yazma ve SELECT ... FOR UPDATE sorguları bilerek yok: rollback edilse de
+# satır/gap kilidi alıp canlı trafikle çakışabilirler. Parametresiz tüm katalog
+# okumaları (listings_all, users_all, view_user_listing_genre) da yok: her
+# startup'ta tabloyu baştan sona okumaya değmez. Kalanlar hiçbir satıra uymayan
+# parametrelerle çalışır.
+WARMUP_PARAMS = {
+    "user_id_by_id": {"uid": ""},
+    "user_id_by_phone": {"phone": ""},
+    "user_password_hash": {"uid": ""},
+    "user_info": {"uid": ""},
+    "user_by_id": {"uid": ""},
+    "listing_by_id": {"id": 0},
+    "listing_genre_names": {"id": 0},
+    "listing_comments": {"id": 0},
+    "listing_owner": {"id": 0},
+    "last_insert_id": {},
+    "listings_search": {"key": ""},
+    "listings_by_ids": {"ids": [0]},
+    "similarity_features_by_id": {"id": 0},
+    "comments_by_listing": {"id": 0},
+    "comment_owner": {"id": 0},
+    "genres_all": {},
+    "purge_pending_listings": {"limit": 1},
+    "image_path_in_use": {"path": ""},
+    "purge_backlog": {},
+}
+
+
+def warm_up_pool():
+    if DB_POOL_WARMUP <= 0:
+        return
+
+    statements = [(STATEMENTS[key], params) for key, params in WARMUP_PARAMS.items()]
+    # Negatif fiyat hiçbir ilana uymaz, sıralı DISTINCT sorgusu boş döner
+    no_match_filter = {"name": None, "city": None, "min_price": None, "max_price": -1, "genre": None}
+    statements += [(stmt, no_match_filter) for stmt in FILTER_STATEMENTS.values()]
+
+    try:
+        # Bağlantıları aynı anda açık tut ki havuz gerçekten DB_POOL_WARMUP kadar bağlantı kursun
+        conns = []
+        try:
+            for _ in range(DB_POOL_WARMUP):
+                conns.append(engine.connect())
+
+            for i, (stmt, params) in enumerate(statements):
+                result = conns[i % len(conns)].execute(stmt, params)
+                if result.returns_rows:
+                    result.fetchall()
+        finally:
+            # Sadece okuma yapıldı; close() açık transaction'ı rollback ile kapatır
+            for conn in conns:
+                conn.close()
+    except SQLAlchemyError as e:
+        print(f"Pool warm-up failed: {e}")
+
+
 # -----------------------------
 # AUTH ENDPOINTS
 # -----------------------------
@@ -120,7 +785,7 @@ def register_user(user: UserRegister):
     with engine.connect() as conn:
         # Kullanıcı zaten var mı kontrol et
         existing = conn.execute(
-            text("SELECT user_id FROM users_table WHERE user_id = :uid"),
+            STATEMENTS["user_id_by_id"],
             {"uid": user.user_id}
         ).fetchone()
         
@@ -129,7 +794,7 @@ def register_user(user: UserRegister):
         
         # Telefon numarası zaten var mı kontrol et
         existing_phone = conn.execute(
-            text("SELECT user_id FROM users_table WHERE user_phonenumber = :phone"),
+            STATEMENTS["user_id_by_phone"],
             {"phone": user.user_phonenumber}
         ).fetchone()
         
@@ -139,12 +804,7 @@ def register_user(user: UserRegister):
         # Şifreyi hashle ve kullanıcıyı ekle
         hashed_pwd = hash_password(user.password)
         conn.execute(
-            text("""
-                INSERT INTO users_table 
-                (user_id, user_name, user_city, user_restofaddress, 
-                 user_phonenumber, user_passwordhashes)
-                VALUES (:uid, :name, :city, :addr, :phone, :pwd)
-            """),
+            STATEMENTS["user_insert"],
             {
                 "uid": user.user_id,
                 "name": user.user_name,
@@ -162,7 +822,7 @@ def register_user(user: UserRegister):
 def login_user(user: UserLogin, response: Response):
     with engine.connect() as conn:
         result = conn.execute(
-            text("SELECT user_passwordhashes FROM users_table WHERE user_id = :uid"),
+            STATEMENTS["user_password_hash"],
             {"uid": user.user_id}
         ).fetchone()
         
@@ -211,11 +871,7 @@ def get_current_user_info(access_token: Optional[str] = Cookie(None)):
         
         with engine.connect() as conn:
             result = conn.execute(
-                text("""
-                    SELECT user_id, user_name, user_city, user_restofaddress, user_phonenumber 
-                    FROM users_table 
-                    WHERE user_id = :uid
-                """),
+                STATEMENTS["user_info"],
                 {"uid": user_id}
             ).fetchone()
             
@@ -233,16 +889,16 @@ def get_current_user_info(access_token: Optional[str] = Cookie(None)):
 @app.get("/users")
 def get_users():
     with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM users_table"))
-        users = [dict(row._mapping) for row in result]
-    return users
+        result = conn.execute(STATEMENTS["users_all"])
+        users = rows_to_dicts(result)
+    return FastJSONResponse(users)
 
 
 @app.get("/users/{user_id}")
 def get_user(user_id: str):
     with engine.connect() as conn:
         result = conn.execute(
-            text("SELECT * FROM users_table WHERE user_id = :uid"),
+            STATEMENTS["user_by_id"],
             {"uid": user_id}
         ).fetchone()
 
@@ -285,18 +941,11 @@ def update_user_profile(
     }
 
     # Eğer yeni parola gönderilmişse hash'le ve ekle
+    sql = STATEMENTS["user_update"]
     if updated_data.new_password:
         hashed = pwd_context.hash(updated_data.new_password)
         update_fields["user_passwordhashes"] = hashed
-
-    # Dinamik SET kısmını oluştur
-    set_clause = ", ".join([f"{key} = :{key}" for key in update_fields.keys()])
-
-    sql = text(f"""
-        UPDATE users_table
-        SET {set_clause}
-        WHERE user_id = :user_id
-    """)
+        sql = STATEMENTS["user_update_with_password"]
 
     update_fields["user_id"] = user_id
 
@@ -315,30 +964,18 @@ def update_user_profile(
 @app.get("/listings")
 def get_all_listings():
     with engine.connect() as conn:
-        result = conn.execute(text("""
-            SELECT 
-                l.*, u.*
-            FROM listings_table l
-            JOIN users_table u 
-            ON l.listing_ownerid = u.user_id
-        """))
+        result = conn.execute(STATEMENTS["listings_all"])
 
-        listings = [dict(row._mapping) for row in result]
+        listings = rows_to_dicts(result)
 
-    return listings
+    return FastJSONResponse(listings)
 
 
 @app.get("/listings/{listing_id}")
 def get_listing(listing_id: int):
     with engine.connect() as conn:
         listing = conn.execute(
-            text("""
-                 SELECT l.*, u.*
-                 FROM listings_table as l
-                 JOIN users_table as u
-                 ON l.listing_ownerid = u.user_id 
-                 WHERE listing_id = :id
-                 """),
+            STATEMENTS["listing_by_id"],
             {"id": listing_id}
         ).fetchone()
 
@@ -346,29 +983,20 @@ def get_listing(listing_id: int):
             raise HTTPException(status_code=404, detail="Listing not found")
 
         genres = conn.execute(
-            text("""
-                SELECT g.genre_name FROM genres g
-                JOIN listing_genres lg ON g.genre_id = lg.genre_id
-                WHERE lg.listing_id = :id
-            """),
+            STATEMENTS["listing_genre_names"],
             {"id": listing_id}
         )
 
         comments = conn.execute(
-            text("""
-                SELECT c.comment_content, c.comment_date, c.comment_id, c.comment_ownerid, u.user_name
-                FROM comments_table c
-                JOIN users_table u ON c.comment_ownerid = u.user_id
-                WHERE c.comment_listingid = :id
-            """),
+            STATEMENTS["listing_comments"],
             {"id": listing_id}
         )
 
-    return {
+    return FastJSONResponse({
         **dict(listing._mapping),
         "genres": [g[0] for g in genres],
-        "comments": [dict(row._mapping) for row in comments]
-    }
+        "comments": rows_to_dicts(comments)
+    })
 
 @app.delete("/listings/delete/{listing_id}")
 def delete_listing(listing_id: int, access_token: Optional[str] = Cookie(None)):
@@ -385,7 +1013,7 @@ def delete_listing(listing_id: int, access_token: Optional[str] = Cookie(None)):
     with engine.connect() as conn:
         # İlan var mı?
         listing = conn.execute(
-            text("SELECT listing_ownerid FROM listings_table WHERE listing_id = :id"),
+            STATEMENTS["listing_owner"],
             {"id": listing_id}
         ).fetchone()
 
@@ -396,25 +1024,18 @@ def delete_listing(listing_id: int, access_token: Optional[str] = Cookie(None)):
         if listing[0] != user_id:
             raise HTTPException(status_code=403, detail="You cannot delete this listing")
 
+        # Sadece işaretle: ilan tüm okuma sorgularından hemen kalkar,
+        # yorum/tür satırları ve resim dosyası purge worker tarafından silinir
         conn.execute(
-            text("DELETE FROM listing_genres WHERE listing_id = :id"),
-            {"id": listing_id}
-        )
-
-        # Önce yorumları sil (FK varsa gerekmez ama kesin çözüm)
-        conn.execute(
-            text("DELETE FROM comments_table WHERE comment_listingid = :id"),
-            {"id": listing_id}
-        )
-
-        # Sonra ilanı sil
-        conn.execute(
-            text("DELETE FROM listings_table WHERE listing_id = :id"),
+            STATEMENTS["listing_soft_delete"],
             {"id": listing_id}
         )
 
         conn.commit()
 
+    similar_index.remove(listing_id)
+    purge_worker.wake()
+
     return {"message": "Listing deleted successfully"}
 
 @app.post("/listings/create")
@@ -430,15 +1051,7 @@ def create_listing(listing: ListingCreate, access_token: Optional[str] = Cookie(
 
     with engine.connect() as conn:
         conn.execute(
-            text("""
-                INSERT INTO listings_table (
-                    listing_name, listing_price, listing_ownerid, 
-                    listing_condition, listing_date, listing_desc, listing_imagepath
-                )
-                VALUES (
-                    :name, :price, :owner, :cond, :date, :desc, :img
-                )
-            """),
+            STATEMENTS["listing_insert"],
             {
                 "name": listing.listing_name,
                 "price": listing.listing_price,
@@ -450,53 +1063,156 @@ def create_listing(listing: ListingCreate, access_token: Optional[str] = Cookie(
             }
         )
 
-        new_id = conn.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+        new_id = conn.execute(STATEMENTS["last_insert_id"]).scalar()
 
         # ⭐ Genre eşleştirmelerini ekleyelim
         if listing.genres:
             for gid in listing.genres:
                 conn.execute(
-                    text("""
-                        INSERT INTO listing_genres (listing_id, genre_id)
-                        VALUES (:lid, :gid)
-                    """),
+                    STATEMENTS["listing_genres_insert"],
                     {"lid": new_id, "gid": gid}
                 )
 
         conn.commit()
 
+        refresh_similar_listing(conn, new_id)
+
     return {"message": "Listing created successfully", "listing_id": new_id}
 
-@app.post("/listings/{listing_id}/upload_image")
-def upload_listing_image(listing_id: int, file: UploadFile = File(...)):
-    # Uzantıyı al
-    filename = file.filename
-    ext = filename.split(".")[-1].lower()
+def sniff_image_ext(head: bytes) -> Optional[str]:
+    # İstemcinin verdiği uzantıya değil, dosyanın ilk byte'larına bakılır
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def fetch_listing_owner(listing_id: int):
+    with engine.connect() as conn:
+        return conn.execute(
+            STATEMENTS["listing_owner"],
+            {"id": listing_id}
+        ).fetchone()
 
-    # yalnızca belirli formatlara izin ver
-    if ext not in ["jpg", "jpeg", "png", "webp"]:
-        raise HTTPException(status_code=400, detail="Geçersiz dosya formatı. (jpg, jpeg, png, webp)")
+def commit_listing_image(listing_id: int, tmp_path: str, ext: str) -> str:
+    final_path = os.path.join(IMAGES_DIR, f"{listing_id}.{ext}")
+    image_path = f"/images/{listing_id}.{ext}"
 
-    # Kaydedilecek nihai dosya adı
-    save_path = f"{IMAGES_DIR}/{listing_id}.{ext}"
+    # DB güncellemesi ve rename aynı transaction içinde: rename başarısız olursa commit edilmez
+    with engine.connect() as conn:
+        listing = conn.execute(
+            STATEMENTS["listing_image_for_update"],
+            {"id": listing_id}
+        ).fetchone()
 
-    # Dosyayı kaydet
-    with open(save_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        if not listing:
+            raise HTTPException(status_code=404, detail="Listing not found")
 
-    # DB içindeki path'i güncelle
-    with engine.connect() as conn:
         conn.execute(
-            text("""
-                UPDATE listings_table 
-                SET listing_imagepath = :path 
-                WHERE listing_id = :id
-            """),
-            {"path": f"/images/{listing_id}.{ext}", "id": listing_id}
+            STATEMENTS["listing_image_update"],
+            {"path": image_path, "id": listing_id}
         )
-        conn.commit()
 
-    return {"message": "Image uploaded.", "image_path": f"/images/{listing_id}.{ext}"}
+        old_path = listing[0]
+
+        # Aynı isimde dosya varsa (ör. aynı uzantıyla yeniden yükleme) os.replace onu
+        # ezecek. Önce hard link ile yedekle: canlı dosya hiç kaybolmaz, commit
+        # başarısız olursa yedek geri konur.
+        backup_path = None
+        if os.path.exists(final_path):
+            backup_path = os.path.join(UPLOAD_TMP_DIR, f"{listing_id}-{secrets.token_hex(8)}.bak.part")
+            os.link(final_path, backup_path)
+
+        try:
+            os.replace(tmp_path, final_path)
+
+            # Rename'in kalıcı olması için klasörü de fsync et (Windows'ta desteklenmiyor)
+            if hasattr(os, "O_DIRECTORY"):
+                dir_fd = os.open(IMAGES_DIR, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+
+            conn.commit()
+        except Exception:
+            # Commit olmadıysa DB eski yolu gösteriyor; diskteki dosyayı da eski haline getir
+            if backup_path:
+                os.replace(backup_path, final_path)
+            elif os.path.exists(final_path):
+                os.remove(final_path)
+            raise
+
+        if backup_path:
+            os.remove(backup_path)
+
+    # Farklı uzantılı eski resim kaldıysa sil
+    if old_path and old_path != image_path and old_path.startswith(f"/images/{listing_id}."):
+        old_file = os.path.join(IMAGES_DIR, os.path.basename(old_path))
+        if os.path.exists(old_file):
+            os.remove(old_file)
+
+    return image_path
+
+@app.post("/listings/{listing_id}/upload_image")
+async def upload_listing_image(
+    listing_id: int,
+    file: UploadFile = File(...),
+    access_token: Optional[str] = Cookie(None)
+):
+    if not access_token:
+        raise HTTPException(status_code=401, detail="Not authorized")
+
+    try:
+        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    # Sync DB çağrıları event loop'u bloklamasın diye threadpool'da kısa süreli çalışır
+    listing = await run_in_threadpool(fetch_listing_owner, listing_id)
+
+    if not listing:
+        raise HTTPException(status_code=404, detail="Listing not found")
+
+    if listing[0] != user_id:
+        raise HTTPException(status_code=403, detail="You cannot edit this listing")
+
+    # Önce servis edilmeyen geçici klasöre yaz, okuyucular yarım dosya görmesin
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, prefix=f"{listing_id}-", suffix=".part")
+    os.close(fd)
+
+    try:
+        ext = None
+        size = 0
+
+        async with await anyio.open_file(tmp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                if ext is None:
+                    ext = sniff_image_ext(chunk)
+                    if ext is None:
+                        raise HTTPException(status_code=400, detail="Geçersiz dosya formatı. (jpg, jpeg, png, webp)")
+
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+
+                await buffer.write(chunk)
+
+            await buffer.flush()
+            await anyio.to_thread.run_sync(os.fsync, buffer.wrapped.fileno())
+
+        if ext is None:
+            raise HTTPException(status_code=400, detail="Empty file")
+
+        image_path = await run_in_threadpool(commit_listing_image, listing_id, tmp_path, ext)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {"message": "Image uploaded.", "image_path": image_path}
 
 @app.put("/listings/{listing_id}/update")
 def update_listing(listing_id: int, data: ListingUpdate, access_token: Optional[str] = Cookie(None)):
@@ -508,7 +1224,7 @@ def update_listing(listing_id: int, data: ListingUpdate, access_token: Optional[
 
     with engine.connect() as conn:
         owner = conn.execute(
-            text("SELECT listing_ownerid FROM listings_table WHERE listing_id = :id"),
+            STATEMENTS["listing_owner"],
             {"id": listing_id}
         ).fetchone()
 
@@ -516,15 +1232,7 @@ def update_listing(listing_id: int, data: ListingUpdate, access_token: Optional[
             raise HTTPException(status_code=403, detail="Yetkin yok")
 
         conn.execute(
-            text("""
-                UPDATE listings_table
-                SET 
-                    listing_name = :name,
-                    listing_price = :price,
-                    listing_condition = :cond,
-                    listing_desc = :desc
-                WHERE listing_id = :id
-            """),
+            STATEMENTS["listing_update"],
             {
                 "id": listing_id,
                 "name": data.listing_name,
@@ -536,20 +1244,478 @@ def update_listing(listing_id: int, data: ListingUpdate, access_token: Optional[
 
         # Genre güncelle
         conn.execute(
-            text("DELETE FROM listing_genres WHERE listing_id = :id"),
+            STATEMENTS["listing_genres_delete"],
             {"id": listing_id}
         )
 
         for gid in data.genres:
             conn.execute(
-                text("INSERT INTO listing_genres (listing_id, genre_id) VALUES (:lid, :gid)"),
+                STATEMENTS["listing_genres_insert"],
                 {"lid": listing_id, "gid": gid}
             )
 
         conn.commit()
 
+        refresh_similar_listing(conn, listing_id)
+
     return {"message": "Listing updated"}
 
+# -----------------------------
+# SIMILAR LISTINGS
+# -----------------------------
+# Her ilan için en benzer SIMILAR_TOP_K ilan bellekte önceden hesaplanır.
+# Skor = tür kümesi Jaccard benzerliği + fiyat yakınlığı + aynı şehir.
+SIMILAR_TOP_K = int(os.getenv("SIMILAR_TOP_K", "10"))
+SIMILAR_GENRE_WEIGHT = 0.6
+SIMILAR_PRICE_WEIGHT = 0.3
+SIMILAR_CITY_WEIGHT = 0.1
+# Index startup'ta kurulamazsa (ör. DB erişilemiyor) istek üzerine en fazla bu
+# aralıkla yeniden denenir; o sırada endpoint 503 döner
+SIMILAR_RETRY_SECONDS = float(os.getenv("SIMILAR_RETRY_SECONDS", "30"))
+# Toplu hesapta blok x n boyutlu ara diziler için bellek bütçesi. Blok boyu
+# katalog büyüdükçe küçülür, böylece tepe bellek n'den bağımsız kalır.
+SIMILAR_MEMORY_BUDGET = int(os.getenv("SIMILAR_MEMORY_BUDGET", str(64 * 1024 * 1024)))
+SIMILAR_BYTES_PER_CELL = 4 * 6   # _scores + argpartition'daki ~6 float32 boyutlu ara dizi
+
+
+class SimilarListingsIndex:
+    def __init__(self, k: int = SIMILAR_TOP_K):
+        self.k = k
+        self.lock = threading.Lock()
+        self.built = False                 # rebuild() en az bir kez başarıyla bitti mi
+        self.last_build_attempt = None     # time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.positions = {}                              # listing_id -> satır
+        self.genres = np.zeros((0, 0), dtype=np.float32)  # satır x tür (0/1)
+        self.genre_columns = {}                          # genre_id -> kolon
+        self.prices = np.zeros(0, dtype=np.float32)
+        self.cities = np.zeros(0, dtype=np.int64)
+        self.city_codes = {}                             # şehir adı -> kod
+        self.neighbors = {}                              # listing_id -> [(listing_id, skor), ...]
+
+    def _scores(self, rows: np.ndarray) -> np.ndarray:
+        """rows içindeki her satırın tüm ilanlara skoru (len(rows) x n)."""
+        genres = self.genres[rows]
+        intersection = genres @ self.genres.T
+        counts = self.genres.sum(axis=1)
+        union = counts[rows, None] + counts[None, :] - intersection
+        # union 0 ise kesişim de 0, yerinde bölmede o hücreler 0 kalır
+        jaccard = np.divide(intersection, union, out=intersection, where=union > 0)
+
+        # Ara diziler büyük (blok x n), bu yüzden işlemler yerinde yapılır
+        prices = self.prices[rows, None]
+        highest = np.maximum(prices, self.prices[None, :])
+        distance = np.abs(prices - self.prices[None, :])
+        np.divide(distance, highest, out=distance, where=highest > 0)
+
+        scores = jaccard
+        scores *= SIMILAR_GENRE_WEIGHT
+        scores += SIMILAR_PRICE_WEIGHT
+        distance *= SIMILAR_PRICE_WEIGHT
+        scores -= distance
+        scores += (self.cities[rows, None] == self.cities[None, :]).astype(np.float32) * np.float32(SIMILAR_CITY_WEIGHT)
+
+        # ilan kendisine benzer sayılmaz
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+
+    def _top_k(self, scores: np.ndarray) -> list:
+        k = min(self.k, len(scores) - 1)
+        if k <= 0:
+            return []
+
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(self.ids[i]), round(float(scores[i]), 4)) for i in best]
+
+    def _block_size(self) -> int:
+        return max(1, SIMILAR_MEMORY_BUDGET // (max(len(self.ids), 1) * SIMILAR_BYTES_PER_CELL))
+
+    def _recompute(self, rows: np.ndarray):
+        k = min(self.k, len(self.ids) - 1)
+        block_size = self._block_size()
+
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+
+            if k <= 0:
+                for row in block:
+                    self.neighbors[int(self.ids[row])] = []
+                continue
+
+            # Blok için top-k seçimi ve sıralaması tek seferde
+            scores = self._scores(block)
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.round(np.take_along_axis(best_scores, order, axis=1).astype(np.float64), 4)
+
+            for row, neighbor_ids, neighbor_scores in zip(block.tolist(), self.ids[best].tolist(), best_scores.tolist()):
+                self.neighbors[int(self.ids[row])] = list(zip(neighbor_ids, neighbor_scores))
+
+    def _city_code(self, city: str) -> int:
+        return self.city_codes.setdefault(city, len(self.city_codes))
+
+    def _genre_row(self, genre_ids) -> np.ndarray:
+        for gid in genre_ids:
+            if gid not in self.genre_columns:
+                self.genre_columns[gid] = len(self.genre_columns)
+                self.genres = np.hstack([self.genres, np.zeros((len(self.ids), 1), dtype=np.float32)])
+
+        row = np.zeros(len(self.genre_columns), dtype=np.float32)
+        row[[self.genre_columns[gid] for gid in genre_ids]] = 1.0
+        return row
+
+    def rebuild(self, features: dict):
+        """features: listing_id -> (fiyat, şehir, {genre_id, ...}). Tüm katalog için vektörel hesap."""
+        with self.lock:
+            self._reset()
+
+            for listing_id, (_, city, genre_ids) in features.items():
+                self._city_code(city)
+                for gid in genre_ids:
+                    self.genre_columns.setdefault(gid, len(self.genre_columns))
+
+            self.ids = np.array(list(features), dtype=np.int64)
+            self.positions = {listing_id: i for i, listing_id in enumerate(features)}
+            self.prices = np.array([float(price) for price, _, _ in features.values()], dtype=np.float32)
+            self.cities = np.array([self.city_codes[city] for _, city, _ in features.values()], dtype=np.int64)
+            self.genres = np.zeros((len(features), len(self.genre_columns)), dtype=np.float32)
+            for i, (_, _, genre_ids) in enumerate(features.values()):
+                self.genres[i, [self.genre_columns[gid] for gid in genre_ids]] = 1.0
+
+            self._recompute(np.arange(len(self.ids)))
+            self.built = True
+
+    def upsert(self, listing_id: int, price, city: str, genre_ids):
+        """Tek ilanın değişikliğini uygular; sadece etkilenen komşu listeleri güncellenir."""
+        with self.lock:
+            # Index hiç kurulmadıysa kısmi veri tutma, ilk rebuild bu ilanı da okur
+            if not self.built:
+                return
+
+            genre_row = self._genre_row(genre_ids)
+
+            if listing_id in self.positions:
+                row = self.positions[listing_id]
+                self.genres[row] = genre_row
+                self.prices[row] = float(price)
+                self.cities[row] = self._city_code(city)
+            else:
+                row = len(self.ids)
+                self.positions[listing_id] = row
+                self.ids = np.append(self.ids, listing_id)
+                self.genres = np.vstack([self.genres, genre_row[None, :]])
+                self.prices = np.append(self.prices, np.float32(price))
+                self.cities = np.append(self.cities, self._city_code(city))
+
+            # Skor simetrik: bu satır, diğer ilanların bu ilana olan skorunu da verir
+            scores = self._scores(np.array([row]))[0]
+            self.neighbors[listing_id] = self._top_k(scores)
+
+            stale = []
+            for other_row, other_id in enumerate(self.ids.tolist()):
+                if other_id == listing_id:
+                    continue
+
+                current = self.neighbors.get(other_id, [])
+                if any(n == listing_id for n, _ in current):
+                    # Skoru düşmüş olabilir, listeden çıkıp başka biri girebilir
+                    stale.append(other_row)
+                elif len(current) < self.k or scores[other_row] > current[-1][1]:
+                    current = current + [(listing_id, round(float(scores[other_row]), 4))]
+                    current.sort(key=lambda n: -n[1])
+                    self.neighbors[other_id] = current[:self.k]
+
+            if stale:
+                self._recompute(np.array(stale))
+
+    def remove(self, listing_id: int):
+        with self.lock:
+            row = self.positions.pop(listing_id, None)
+            if row is None:
+                return
+
+            self.ids = np.delete(self.ids, row)
+            self.genres = np.delete(self.genres, row, axis=0)
+            self.prices = np.delete(self.prices, row)
+            self.cities = np.delete(self.cities, row)
+            self.positions = {int(lid): i for i, lid in enumerate(self.ids)}
+            self.neighbors.pop(listing_id, None)
+
+            stale = [
+                self.positions[other_id]
+                for other_id, current in self.neighbors.items()
+                if any(n == listing_id for n, _ in current)
+            ]
+            if stale:
+                self._recompute(np.array(stale))
+
+    def similar(self, listing_id: int) -> Optional[list]:
+        with self.lock:
+            return self.neighbors.get(listing_id)
+
+
+similar_index = SimilarListingsIndex()
+
+
+def group_similarity_features(rows) -> dict:
+    # Satırlar (listing_id, fiyat, şehir, genre_id) şeklinde, tür başına bir satır
+    features = {}
+    for listing_id, price, city, genre_id in rows:
+        entry = features.setdefault(listing_id, (price, city, set()))
+        if genre_id is not None:
+            entry[2].add(genre_id)
+    return features
+
+
+similar_build_lock = threading.Lock()
+
+
+def rebuild_similar_index(blocking: bool = True) -> bool:
+    # Aynı anda tek build; blocking=False ise devam eden build beklenmez
+    if not similar_build_lock.acquire(blocking=blocking):
+        return False
+
+    try:
+        similar_index.last_build_attempt = time.monotonic()
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(STATEMENTS["similarity_features_all"]).fetchall()
+        except SQLAlchemyError as e:
+            print(f"Similar listings index build failed: {e}")
+            return False
+
+        similar_index.rebuild(group_similarity_features(rows))
+        return True
+    finally:
+        similar_build_lock.release()
+
+
+def refresh_similar_listing(conn, listing_id: int):
+    rows = conn.execute(STATEMENTS["similarity_features_by_id"], {"id": listing_id}).fetchall()
+    features = group_similarity_features(rows)
+
+    if listing_id in features:
+        price, city, genre_ids = features[listing_id]
+        similar_index.upsert(listing_id, price, city, genre_ids)
+    else:
+        similar_index.remove(listing_id)
+
+
+@app.get("/listings/{listing_id}/similar")
+def get_similar_listings(listing_id: int, limit: int = SIMILAR_TOP_K):
+    if not similar_index.built:
+        last = similar_index.last_build_attempt
+        if last is None or time.monotonic() - last >= SIMILAR_RETRY_SECONDS:
+            rebuild_similar_index(blocking=False)
+
+        # Index yokken "ilan yok" (404) demek yanlış olur
+        if not similar_index.built:
+            raise HTTPException(
+                status_code=503,
+                detail="Similar listings are not available yet",
+                headers={"Retry-After": str(math.ceil(SIMILAR_RETRY_SECONDS))},
+            )
+
+    neighbors = similar_index.similar(listing_id)
+
+    if neighbors is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+
+    neighbors = neighbors[:max(limit, 0)]
+    if not neighbors:
+        return FastJSONResponse([])
+
+    with engine.connect() as conn:
+        result = conn.execute(STATEMENTS["listings_by_ids"], {"ids": [n for n, _ in neighbors]})
+        listings = {row["listing_id"]: row for row in rows_to_dicts(result)}
+
+    # Benzerlik sırasını koru; arada silinmiş ilan varsa atla
+    return FastJSONResponse([
+        {**listings[n], "similarity": score}
+        for n, score in neighbors
+        if n in listings
+    ])
+
+# -----------------------------
+# LISTING PURGE
+# -----------------------------
+# delete_listing ilanı sadece işaretler (listing_deletedat). Bağlı yorum/tür
+# satırları ve resim dosyası bu worker tarafından, her biri kısa bir
+# transaction olan sınırlı batch'lerle silinir; istek yolunda kilit tutulmaz.
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_LISTINGS_PER_RUN = int(os.getenv("PURGE_LISTINGS_PER_RUN", "50"))
+PURGE_INTERVAL_SECONDS = float(os.getenv("PURGE_INTERVAL_SECONDS", "30"))
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+
+
+class PurgeWorker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.started_at = None
+        self.last_run_at = None
+        self.last_run_seconds = 0.0
+        self.last_error = None
+        self.busy_seconds = 0.0
+        self.purged = {"listings": 0, "comments": 0, "listing_genres": 0, "images": 0, "batches": 0}
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.started_at = datetime.utcnow()
+        self.thread = threading.Thread(target=self._run, name="listing-purge", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+
+    def wake(self):
+        self.wake_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.wake_event.clear()
+
+            try:
+                self.run_once()
+            except (SQLAlchemyError, OSError) as e:
+                # Bir sonraki turda tekrar denenir
+                with self.lock:
+                    self.last_error = str(e)
+                print(f"Listing purge failed: {e}")
+
+            self.wake_event.wait(PURGE_INTERVAL_SECONDS)
+
+    def run_once(self) -> int:
+        started = time.monotonic()
+
+        with engine.connect() as conn:
+            pending = conn.execute(
+                STATEMENTS["purge_pending_listings"],
+                {"limit": PURGE_LISTINGS_PER_RUN}
+            ).fetchall()
+
+        last_error = None
+        for listing_id, image_path in pending:
+            if self.stop_event.is_set():
+                break
+
+            # Tek bir ilandaki hata turun geri kalanını durdurmasın
+            try:
+                self.purge_listing(listing_id, image_path)
+            except (SQLAlchemyError, OSError) as e:
+                last_error = f"listing {listing_id}: {e}"
+                print(f"Listing purge failed for {listing_id}: {e}")
+
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.last_run_at = datetime.utcnow()
+            self.last_run_seconds = elapsed
+            self.busy_seconds += elapsed
+            self.last_error = last_error
+
+        # Backlog bitmediyse beklemeden devam et; hata varsa aynı ilanlarda
+        # boşa dönmemek için bir sonraki aralığı bekle
+        if len(pending) == PURGE_LISTINGS_PER_RUN and last_error is None:
+            self.wake_event.set()
+
+        return len(pending)
+
+    def purge_listing(self, listing_id: int, image_path: Optional[str]):
+        with engine.connect() as conn:
+            for key, counter in (("purge_listing_genres_batch", "listing_genres"), ("purge_comments_batch", "comments")):
+                while True:
+                    deleted = conn.execute(
+                        STATEMENTS[key],
+                        {"id": listing_id, "limit": PURGE_BATCH_SIZE}
+                    ).rowcount
+                    conn.commit()
+                    self._count(counter, deleted)
+
+                    if deleted < PURGE_BATCH_SIZE:
+                        break
+
+            # Başka bir süreç aynı ilanı zaten sildiyse rowcount 0 olur, sayılmaz
+            deleted = conn.execute(STATEMENTS["purge_listing"], {"id": listing_id}).rowcount
+            in_use = image_path and conn.execute(
+                STATEMENTS["image_path_in_use"],
+                {"path": image_path}
+            ).fetchone()
+            conn.commit()
+            self._count("listings", deleted)
+
+        if not deleted:
+            return
+
+        # Başka bir ilan aynı dosyayı kullanmıyorsa resmi de sil
+        if image_path and not in_use and image_path.startswith("/images/"):
+            image_file = os.path.join(IMAGES_DIR, os.path.basename(image_path))
+            if os.path.exists(image_file):
+                os.remove(image_file)
+                self._count("images", 1)
+
+    def _count(self, counter: str, amount: int):
+        with self.lock:
+            self.purged[counter] += amount
+            if counter in ("comments", "listing_genres"):
+                self.purged["batches"] += 1
+
+    def status(self) -> dict:
+        with self.lock:
+            purged = dict(self.purged)
+            rows = purged["listings"] + purged["comments"] + purged["listing_genres"]
+            busy = self.busy_seconds
+
+            return {
+                "running": bool(self.thread and self.thread.is_alive()),
+                "started_at": self.started_at,
+                "last_run_at": self.last_run_at,
+                "last_run_seconds": round(self.last_run_seconds, 3),
+                "last_error": self.last_error,
+                "purged": purged,
+                "throughput": {
+                    "listings_per_second": round(purged["listings"] / busy, 2) if busy else 0.0,
+                    "rows_per_second": round(rows / busy, 2) if busy else 0.0,
+                },
+            }
+
+
+purge_worker = PurgeWorker()
+
+
+@app.get("/admin/purge/status")
+def get_purge_status(access_token: Optional[str] = Cookie(None)):
+    if not access_token:
+        raise HTTPException(status_code=401, detail="Not authorized")
+
+    try:
+        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = payload.get("sub")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    with engine.connect() as conn:
+        backlog = conn.execute(STATEMENTS["purge_backlog"]).fetchone()
+
+    return {"backlog": dict(backlog._mapping), **purge_worker.status()}
+
 # -----------------------------
 # SEARCH / FILTER
 # -----------------------------
@@ -557,16 +1723,11 @@ def update_listing(listing_id: int, data: ListingUpdate, access_token: Optional[
 def search_listings(keyword: str = ""):
     with engine.connect() as conn:
         result = conn.execute(
-            text("""
-                SELECT l.*, u.*
-                FROM listings_table l
-                JOIN users_table u ON l.listing_ownerid = u.user_id
-                WHERE l.listing_name LIKE :key
-            """),
+            STATEMENTS["listings_search"],
             {"key": f"%{keyword}%"}
         )
 
-    return [dict(row._mapping) for row in result]
+    return FastJSONResponse(rows_to_dicts(result))
 
 # -----------------------------
 # COMMENTS
@@ -575,37 +1736,19 @@ def search_listings(keyword: str = ""):
 def get_comments(listing_id: int):
     with engine.connect() as conn:
         result = conn.execute(
-            text("""
-                SELECT 
-                    c.*,
-                    u.user_name
-                FROM comments_table c
-                JOIN users_table u 
-                ON u.user_id = c.comment_ownerid
-                WHERE c.comment_listingid = :id
-            """),
+            STATEMENTS["comments_by_listing"],
             {"id": listing_id}
         )
 
-    return [dict(row._mapping) for row in result]
+    return FastJSONResponse(rows_to_dicts(result))
 
 @app.post("/comments/post_comment")
 def post_comment(comment: Comment):
     with engine.connect() as conn:
-        conn.execute(
-            text("""
-                INSERT INTO comments_table (
-                    comment_content, 
-                    comment_date, 
-                    comment_ownerid, 
-                    comment_listingid
-                ) VALUES (
-                    :content, 
-                    :date, 
-                    :owner, 
-                    :listing
-                );
-            """),
+        # Silinmiş (purge bekleyen) ilana yorum eklenmez; INSERT ... SELECT ilan
+        # satırını okurken kilitlediği için silme ile aynı anda çalışamaz
+        result = conn.execute(
+            STATEMENTS["comment_insert"],
             {
                 "content": comment.comment_content,
                 "date": comment.comment_date,       # YYYY-MM-DD formatı
@@ -613,6 +1756,10 @@ def post_comment(comment: Comment):
                 "listing": comment.comment_listingid
             }
         )
+
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Listing not found")
+
         conn.commit()
 
 @app.delete("/comments/delete_comment/{comment_id}")
@@ -629,12 +1776,8 @@ def delete_comment(comment_id: int, access_token: Optional[str] = Cookie(None)):
     with engine.connect() as conn:
         # Yorumu çek
         comment = conn.execute(
-            text("""
-                SELECT comment_ownerid 
-                FROM comments_table 
-                WHERE comment_id = :cid
-            """),
-            {"cid": comment_id}
+            STATEMENTS["comment_owner"],
+            {"id": comment_id}
         ).fetchone()
 
         if not comment:
@@ -646,8 +1789,8 @@ def delete_comment(comment_id: int, access_token: Optional[str] = Cookie(None)):
 
         # Sil
         conn.execute(
-            text("DELETE FROM comments_table WHERE comment_id = :cid"),
-            {"cid": comment_id}
+            STATEMENTS["comment_delete"],
+            {"id": comment_id}
         )
         conn.commit()
 
@@ -668,7 +1811,7 @@ def update_comment(comment_id: int, updated: Comment, access_token: Optional[str
     with engine.connect() as conn:
         # Yorum var mı?
         comment = conn.execute(
-            text("SELECT comment_ownerid FROM comments_table WHERE comment_id = :id"),
+            STATEMENTS["comment_owner"],
             {"id": comment_id}
         ).fetchone()
 
@@ -681,11 +1824,7 @@ def update_comment(comment_id: int, updated: Comment, access_token: Optional[str
 
         # Yorum güncelle
         conn.execute(
-            text("""
-                UPDATE comments_table
-                SET comment_content = :content
-                WHERE comment_id = :id
-            """),
+            STATEMENTS["comment_update"],
             {"content": updated.comment_content, "id": comment_id}
         )
         conn.commit()
@@ -700,9 +1839,9 @@ def update_comment(comment_id: int, updated: Comment, access_token: Optional[str
 @app.get("/view/user_listing_genre")
 def get_view():
     with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM user_listing_genre_view"))
+        result = conn.execute(STATEMENTS["view_user_listing_genre"])
 
-    return [dict(row._mapping) for row in result]
+    return FastJSONResponse(rows_to_dicts(result))
 
 # -----------------------------
 # FILTERING
@@ -718,58 +1857,22 @@ def filter_listings(
     sort_by: str = None,
     sort_order: str = None
 ):
-    query = """
-        SELECT DISTINCT l.*, u.*
-        FROM listings_table l
-        JOIN users_table u ON l.listing_ownerid = u.user_id
-        LEFT JOIN listing_genres lg ON l.listing_id = lg.listing_id
-        LEFT JOIN genres g ON lg.genre_id = g.genre_id
-        WHERE 1=1
-    """
-
-    params = {}
-
-    if name:
-        query += f' AND l.listing_name LIKE "%{name}%"'
-        params["name"] = name
-
-    if city:
-        query += " AND u.user_city = :city"
-        params["city"] = city
-
-    if min_price:
-        query += " AND l.listing_price >= :min_price"
-        params["min_price"] = min_price
-
-    if max_price:
-        query += " AND l.listing_price <= :max_price"
-        params["max_price"] = max_price
-
-    if genre:
-        query += " AND g.genre_name = :genre"
-        params["genre"] = genre
-
-    if sort_by and sort_order:
-        if sort_by == "name":
-            query += " ORDER BY l.listing_name"
-
-        elif sort_by == "price":
-            query += " ORDER BY l.listing_price"
-        
-        if sort_order == "asc":
-            query += " ASC"
-        
-        elif sort_order == "desc":
-            query += " DESC"
-
-
-    print("\nQUERY:\n")
-    print(query)
+    sort_key = None
+    if sort_by in ("name", "price") and sort_order:
+        sort_key = (sort_by, sort_order if sort_order in ("asc", "desc") else "asc")
+
+    params = {
+        "name": f"%{name}%" if name else None,
+        "city": city or None,
+        "min_price": min_price or None,
+        "max_price": max_price or None,
+        "genre": genre or None,
+    }
 
     with engine.connect() as conn:
-        result = conn.execute(text(query), params)
+        result = conn.execute(FILTER_STATEMENTS[sort_key], params)
 
-    return [dict(row._mapping) for row in result]
+    return FastJSONResponse(rows_to_dicts(result))
 
 # -----------------------------
 # GENRES
@@ -778,5 +1881,5 @@ def filter_listings(
 @app.get("/genres")
 def get_all_genres():
     with engine.connect() as conn:
-        result = conn.execute(text("SELECT genre_id, genre_name FROM genres"))
-        return [dict(row._mapping) for row in result]
+        result = conn.execute(STATEMENTS["genres_all"])
+        return FastJSONResponse(rows_to_dicts(result))
@@ -0,0 +1,89 @@
+# Cold-start benchmark: yeni bir süreçte ilk isteğin süresini, ısınmış
+# (steady-state) isteklerin medyanı ile karşılaştırır.
+#
+# Kullanım (MySQL sunucusu .env'deki bilgilerle çalışıyor olmalı):
+#   python bench_coldstart.py
+#
+# Her senaryo ayrı bir alt süreçte çalışır, böylece havuz ve SQLAlchemy
+# cache'i gerçekten boş başlar. DB_POOL_WARMUP=0 warm-up'sız durumu ölçer.
+# Benzer ilan index'i ve purge worker startup'ta kendi bağlantılarını açıp
+# havuzu ısıtacağı için alt süreçte devre dışı bırakılır; böylece iki senaryo
+# arasındaki fark yalnızca pool warm-up'tan gelir.
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ENDPOINTS = [
+    "/listings",
+    "/listings/1",
+    "/filters/listings?sort_by=price&sort_order=asc",
+    "/genres",
+]
+STEADY_RUNS = 50
+
+
+def run_child():
+    # Rate limiter benchmark'ı kesmesin
+    os.environ.setdefault("RATE_LIMIT_RATE", "1000000")
+    os.environ.setdefault("RATE_LIMIT_BURST", "1000000")
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from fastapi.testclient import TestClient
+    import backend
+
+    backend.engine.echo = False
+    backend.rebuild_similar_index = lambda: None
+    backend.purge_worker.start = lambda: None
+    results = {}
+
+    # with bloğu lifespan'i (warm-up) çalıştırır
+    with TestClient(backend.app) as client:
+        for path in ENDPOINTS:
+            start = time.perf_counter()
+            client.get(path)
+            first = time.perf_counter() - start
+
+            timings = []
+            for _ in range(STEADY_RUNS):
+                start = time.perf_counter()
+                client.get(path)
+                timings.append(time.perf_counter() - start)
+
+            results[path] = {"first": first, "steady": statistics.median(timings)}
+
+    print(json.dumps(results))
+
+
+def run_scenario(warmup: str):
+    env = {**os.environ, "DB_POOL_WARMUP": warmup}
+    out = subprocess.run(
+        [sys.executable, __file__, "--child"],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    scenarios = {
+        "no warm-up": run_scenario("0"),
+        "warm-up": run_scenario(os.getenv("DB_POOL_SIZE", "5")),
+    }
+
+    print(f"{'endpoint':50} {'scenario':12} {'first ms':>10} {'steady ms':>10} {'ratio':>7}")
+    for path in ENDPOINTS:
+        for name, results in scenarios.items():
+            first = results[path]["first"] * 1000
+            steady = results[path]["steady"] * 1000
+            print(f"{path:50} {name:12} {first:10.2f} {steady:10.2f} {first / steady:7.1f}")
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        run_child()
+    else:
+        main()
@@ -0,0 +1,109 @@
+# Serialization benchmark: 10k ilanlık bir /listings cevabını eski yol
+# (dict(row._mapping) + jsonable_encoder + json) ile yeni yol
+# (rows_to_dicts + orjson) arasında karşılaştırır. Byte boyutu, CPU süresi,
+# gzip/brotli ile sıkıştırılmış boyutları ve sıkıştırma sürelerini yazar.
+#
+# Kullanım:
+#   python bench_serialization.py
+#
+# MySQL gerekmez: satırlar bellek içi SQLite'tan, listings_table/users_table
+# ile aynı kolon ve tiplerle (Decimal fiyat, date tarih) okunur.
+import json
+import logging
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Date, Integer, Numeric, String, create_engine, text
+
+logging.disable(logging.CRITICAL)
+
+import backend
+
+ROWS = 10_000
+REPEAT = 5
+
+COLUMNS = {
+    "listing_id": Integer, "listing_name": String, "listing_price": Numeric(6, 2),
+    "listing_ownerid": String, "listing_condition": String, "listing_date": Date,
+    "listing_desc": String, "listing_imagepath": String,
+    "user_id": String, "user_name": String, "user_city": String,
+    "user_restofaddress": String, "user_phonenumber": String, "user_passwordhashes": String,
+}
+
+
+def load_rows(conn):
+    conn.execute(text(f"CREATE TABLE t ({', '.join(COLUMNS)})"))
+    conn.execute(
+        text(f"INSERT INTO t VALUES ({', '.join(':' + c for c in COLUMNS)})"),
+        [
+            {
+                "listing_id": i, "listing_name": f"The Witcher 3: Wild Hunt (PC) #{i}",
+                "listing_price": 150.0 + i % 800, "listing_ownerid": "davidgilmour70",
+                "listing_condition": "İyi", "listing_date": "2024-11-01",
+                "listing_desc": "Tüm DLC'ler dahil, kutulu PC sürümü. Çizik yok.",
+                "listing_imagepath": f"/images/{i}.jpg",
+                "user_id": "davidgilmour70", "user_name": "David Gilmour", "user_city": "İstanbul",
+                "user_restofaddress": "Kadıköy, Moda Mahallesi", "user_phonenumber": "05510000001",
+                "user_passwordhashes": "$2b$12$.xe3mfDIJLV9e34n0Y5jiO.sjjfBLuiP2T94oUdbEuXNrXoQdRVLS",
+            }
+            for i in range(ROWS)
+        ],
+    )
+    return text("SELECT * FROM t").columns(**COLUMNS)
+
+
+def old_path(result):
+    # FastAPI'nin varsayılan yolu: handler dict listesi döner, FastAPI
+    # jsonable_encoder'dan geçirir, JSONResponse json.dumps ile yazar
+    content = jsonable_encoder([dict(row._mapping) for row in result])
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def new_path(result):
+    return backend.FastJSONResponse(backend.rows_to_dicts(result)).body
+
+
+def measure(conn, stmt, render):
+    cpu = []
+    for _ in range(REPEAT):
+        result = conn.execute(stmt)
+        start = time.process_time()
+        body = render(result)
+        cpu.append(time.process_time() - start)
+    return body, min(cpu)
+
+
+def measure_compression(body, encoding):
+    cpu = []
+    for _ in range(REPEAT):
+        start = time.process_time()
+        compressed = backend.compress_body(body, encoding)
+        cpu.append(time.process_time() - start)
+    return len(compressed), min(cpu)
+
+
+def main():
+    engine = create_engine("sqlite://")
+
+    with engine.connect() as conn:
+        stmt = load_rows(conn)
+        old_body, old_cpu = measure(conn, stmt, old_path)
+        new_body, new_cpu = measure(conn, stmt, new_path)
+
+    assert json.loads(old_body) == json.loads(new_body), "outputs differ"
+
+    print(f"{ROWS} listings, best of {REPEAT}")
+    print(f"{'path':10} {'cpu ms':>10} {'bytes':>10} {'gzip':>10} {'gzip ms':>10} {'br':>10} {'br ms':>10}")
+    for name, body, cpu in (("old", old_body, old_cpu), ("new", new_body, new_cpu)):
+        gz, gz_cpu = measure_compression(body, "gzip")
+        br, br_cpu = measure_compression(body, "br")
+        print(
+            f"{name:10} {cpu * 1000:10.1f} {len(body):10} "
+            f"{gz:10} {gz_cpu * 1000:10.1f} {br:10} {br_cpu * 1000:10.1f}"
+        )
+    print(f"speedup: {old_cpu / new_cpu:.1f}x")
+    print(f"compression offloaded to a thread above {backend.COMPRESS_OFFLOAD_BYTES} bytes")
+
+
+if __name__ == "__main__":
+    main()